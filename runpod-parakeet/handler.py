@@ -6,8 +6,15 @@ With full preprocessing pipeline: DeepFilterNet, nara_wpe, Silero VAD, pyannote
 This version uses FastAPI for Load Balancer endpoints
 """
 import os
+import json
+import asyncio
 import base64
-import tempfile
+import io
+import hashlib
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
 import torch
 import numpy as np
 import torchaudio
@@ -18,6 +25,13 @@ import uvicorn
 # Initialize device
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"Using device: {device}")
+# Let fp32 matmuls (DeepFilterNet, pyannote) use TF32 tensor cores on Ampere+
+torch.set_float32_matmul_precision("high")
+
+# Grad mode is thread-local: this covers model loading and warmup on the main
+# thread only. Model calls on executor threads enter inference_mode themselves
+# (Silero VAD runs under its own no_grad)
+torch.set_grad_enabled(False)
 
 # Initialize Silero VAD
 print("Loading Silero VAD model...")
@@ -25,7 +39,7 @@ vad_model, vad_utils = torch.hub.load(
     repo_or_dir='snakers4/silero-vad',
     model='silero_vad',
     force_reload=False,
-    onnx=False
+    onnx=(device == "cpu")  # ONNX Runtime beats TorchScript on CPU-only hosts
 )
 (get_speech_timestamps, save_audio, read_audio, VADIterator, collect_chunks) = vad_utils
 print("Silero VAD model loaded")
@@ -34,13 +48,22 @@ print("Silero VAD model loaded")
 print("Loading DeepFilterNet3 model...")
 from df import enhance, init_df
 df_model, df_state, _ = init_df()
+if device == "cuda":
+    # enhance() builds features on CUDA when available; keep the RNN there too
+    df_model = df_model.to(device).eval()
+# Dynamic int8 quantization of the Linear/GRU layers on CPU-only hosts
+# (quantized kernels are CPU-only; set DF_QUANTIZE=0 to keep FP32)
+if device == "cpu" and os.environ.get("DF_QUANTIZE", "1") == "1":
+    df_model = torch.ao.quantization.quantize_dynamic(
+        df_model, {torch.nn.Linear, torch.nn.GRU}, dtype=torch.qint8
+    )
+    print("DeepFilterNet3 quantized to int8 (dynamic)")
 print("DeepFilterNet3 model loaded successfully!")
 
 # Initialize nara_wpe
 print("Loading nara_wpe for dereverberation...")
 from nara_wpe.wpe import wpe
-from nara_wpe.utils import stft, istft
-import soundfile as sf
+from nara_wpe.torch_wpe import wpe_v6 as torch_wpe
 print("nara_wpe loaded successfully!")
 
 # Initialize pyannote for speaker diarization
@@ -63,6 +86,10 @@ except Exception as e:
     diarization_pipeline = None
     print(f"Warning: pyannote loading failed: {e}")
 
+# Diarization runs in its own thread; a dedicated CUDA stream lets its kernels
+# overlap with the ASR model instead of queueing behind it on the default stream
+diarization_stream = torch.cuda.Stream() if device == "cuda" else None
+
 # Initialize NVIDIA Parakeet-TDT Japanese model
 print("Loading NVIDIA Parakeet-TDT 0.6B (Japanese) model...")
 import nemo.collections.asr as nemo_asr
@@ -71,15 +98,52 @@ model = nemo_asr.models.ASRModel.from_pretrained(
 )
 model = model.to(device)
 model.eval()
+
+# The Conformer encoder is GEMM-bound: run it under autocast, in bf16 where the
+# GPU supports it (Ampere+) and fp16 otherwise (e.g. T4)
+ASR_AMP_DTYPE = (
+    torch.bfloat16 if device == "cuda" and torch.cuda.is_bf16_supported() else torch.float16
+)
 print(f"NVIDIA Parakeet-TDT (ja) loaded on {device}")
 
 # FastAPI App
 app = FastAPI(title="NVIDIA Parakeet-TDT API")
 
+# Transcription queue: a single background worker drains pending requests in
+# batches so inference never blocks the event loop and the model sees one
+# batched call instead of N serial ones
+MAX_BATCH = int(os.environ.get("MAX_BATCH", 4))
+transcribe_executor = ThreadPoolExecutor(max_workers=1)
+transcribe_queue: asyncio.Queue = None
+
+# Preprocessing runs off the event loop but one request at a time: Silero and
+# DeepFilterNet keep recurrent/analysis state inside the shared global models
+preprocess_executor = ThreadPoolExecutor(max_workers=1)
+
+# Diarization runs beside preprocessing + transcription, but one request at a
+# time: every run shares the pyannote pipeline and its CUDA stream
+diarization_executor = ThreadPoolExecutor(max_workers=1)
+
+# Inputs with an estimated SNR above this are clean enough to skip DeepFilterNet
+DENOISE_SNR_THRESHOLD_DB = float(os.environ.get("DENOISE_SNR_THRESHOLD_DB", 25))
+
+# Clips shorter than this carry too little reverb tail for WPE to help
+WPE_MIN_DURATION_S = float(os.environ.get("WPE_MIN_DURATION_S", 3))
+
+# Energy pre-filter ahead of Silero: silences at least VAD_MIN_SKIP_S long and
+# within VAD_ENERGY_MARGIN_DB of the noise floor never reach the neural VAD
+VAD_ENERGY_MARGIN_DB = float(os.environ.get("VAD_ENERGY_MARGIN_DB", 6))
+VAD_MIN_SKIP_S = float(os.environ.get("VAD_MIN_SKIP_S", 1.0))
+
+# LRU of recent responses keyed by audio content + options
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 256))
+result_cache = OrderedDict()
+
 
 class TranscribeRequest(BaseModel):
     audio_base64: str
     enable_denoise: bool = True
+    force_denoise: bool = False
     enable_dereverberation: bool = True
     enable_vad: bool = True
     enable_diarization: bool = False
@@ -93,148 +157,462 @@ class TranscribeResponse(BaseModel):
     dereverb_applied: bool = False
     vad_applied: bool = False
     diarization: list = []
+    cached: bool = False
+
+
+class TranscribeBatchRequest(BaseModel):
+    requests: list[TranscribeRequest]
+
+
+class TranscribeBatchError(BaseModel):
+    error: str
+
+
+def result_cache_key(request: TranscribeRequest) -> str:
+    """Hash the encoded audio together with every other request option"""
+    digest = hashlib.blake2b(request.audio_base64.encode("ascii"), digest_size=16)
+    options = request.model_dump(exclude={"audio_base64"})
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_cached_result(key: str):
+    """Return the cached response for key, or None"""
+    response = result_cache.get(key)
+    if response is not None:
+        result_cache.move_to_end(key)
+    return response
+
+
+def store_result(key: str, response: TranscribeResponse) -> None:
+    """Cache a response, evicting the least recently used entries"""
+    result_cache[key] = response
+    result_cache.move_to_end(key)
+    while len(result_cache) > RESULT_CACHE_SIZE:
+        result_cache.popitem(last=False)
+
+
+# Resample kernels are expensive to build, so keep one per (src, dst) pair
+_resamplers: dict = {}
+
+
+def get_resampler(orig_freq: int, new_freq: int) -> torchaudio.transforms.Resample:
+    """Return a cached resampler for the given rate pair"""
+    key = (orig_freq, new_freq)
+    if key not in _resamplers:
+        _resamplers[key] = torchaudio.transforms.Resample(orig_freq=orig_freq, new_freq=new_freq)
+    return _resamplers[key]
 
 
-def apply_deepfilter(audio_path: str) -> str:
-    """Apply DeepFilterNet3 noise suppression"""
+def load_audio(source) -> tuple:
+    """Decode a path or file-like object to a mono waveform at its native rate, returns (wav, sr)"""
+    audio, sr = torchaudio.load(source)
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+    return audio.squeeze(0), sr
+
+
+def resample_to(wav: torch.Tensor, orig_freq: int, new_freq: int = 16000) -> torch.Tensor:
+    """Resample a mono waveform, skipping the no-op case"""
+    if orig_freq == new_freq:
+        return wav
+    return get_resampler(orig_freq, new_freq)(wav.unsqueeze(0)).squeeze(0)
+
+
+def estimate_snr_db(wav: torch.Tensor, sample_rate: int = 16000) -> float:
+    """Estimate SNR (dB) from the spread of 10ms frame energies"""
+    frame_size = sample_rate // 100
+    audio = wav.numpy()
+    frames = audio[: len(audio) // frame_size * frame_size].reshape(-1, frame_size)
+    if len(frames) < 2:
+        return 0.0
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    noise, signal = np.percentile(rms, [10, 90])
+    return float(20 * np.log10(signal / max(noise, 1e-6)))
+
+
+def apply_deepfilter(wav: torch.Tensor, sample_rate: int = 16000, regions: list = None) -> torch.Tensor:
+    """
+    Apply DeepFilterNet3 noise suppression at the decoded rate, returns 16kHz.
+    If regions are given only those are enhanced; the rest passes through.
+    Returns None if DeepFilterNet fails.
+    """
+    if regions is not None and not regions:
+        return wav
     try:
-        audio, sr = torchaudio.load(audio_path)
-        if sr != 48000:
-            resampler = torchaudio.transforms.Resample(orig_freq=sr, new_freq=48000)
-            audio = resampler(audio)
-            sr = 48000
-        if audio.shape[0] > 1:
-            audio = torch.mean(audio, dim=0, keepdim=True)
-        enhanced = enhance(df_model, df_state, audio.squeeze().numpy())
-        enhanced_tensor = torch.from_numpy(enhanced).unsqueeze(0)
-        resampler_down = torchaudio.transforms.Resample(orig_freq=48000, new_freq=16000)
-        enhanced_16k = resampler_down(enhanced_tensor)
-        denoised_path = audio_path.replace('.wav', '_denoised.wav')
-        torchaudio.save(denoised_path, enhanced_16k, 16000)
-        return denoised_path
+        speech = wav if regions is None else torch.cat([wav[start:end] for start, end in regions])
+        audio = resample_to(speech, sample_rate, 48000)
+        with torch.inference_mode():
+            # enhance() takes and returns a [C, T] tensor
+            enhanced = enhance(df_model, df_state, audio.unsqueeze(0))
+        enhanced = resample_to(enhanced.squeeze(0), 48000, 16000)
+        if regions is None:
+            return enhanced
+        # Paste each enhanced region back over the 16kHz pass-through signal
+        output = resample_to(wav, sample_rate, 16000).clone()
+        offset = 0
+        for start, end in regions:
+            dst = start * 16000 // sample_rate
+            length = min((end - start) * 16000 // sample_rate, len(output) - dst, len(enhanced) - offset)
+            output[dst:dst + length] = enhanced[offset:offset + length]
+            offset += length
+        return output
     except Exception as e:
         print(f"DeepFilterNet processing failed: {e}")
-        return audio_path
-
-
-def apply_wpe(audio_path: str) -> str:
-    """Apply nara_wpe dereverberation"""
+        return None
+
+
+@torch.inference_mode()
+def apply_wpe_gpu(wav: torch.Tensor) -> torch.Tensor:
+    """cuFFT STFT -> WPE batched over all bins -> iSTFT without leaving the GPU"""
+    window = torch.hann_window(512, device=device)
+    Y = torch.stft(wav.to(device), n_fft=512, hop_length=128, window=window, return_complex=True)
+    # (F, T) -> (F, D=1, T): one single-channel WPE problem per frequency bin
+    Z = torch_wpe(Y[:, None, :], taps=10, delay=3, iterations=3, statistics_mode='full')
+    z = torch.istft(Z[:, 0, :], n_fft=512, hop_length=128, window=window, length=len(wav))
+    # Peak-normalize in place; the where() guards silence without a host sync
+    low, high = torch.aminmax(z)
+    peak = torch.maximum(-low, high)
+    z.mul_(torch.where(peak > 0, 0.9 / peak, torch.ones_like(peak)))
+    return z.cpu()
+
+
+def apply_wpe(wav: torch.Tensor) -> torch.Tensor:
+    """Apply nara_wpe dereverberation to a 16kHz waveform, None if it fails"""
+    if device == "cuda":
+        try:
+            return apply_wpe_gpu(wav)
+        except Exception as e:
+            print(f"GPU WPE failed, falling back to CPU: {e}")
     try:
-        audio, sr = sf.read(audio_path)
-        if len(audio.shape) > 1:
-            audio = np.mean(audio, axis=1)
-        stft_options = dict(size=512, shift=128)
-        Y = stft(audio, **stft_options).T
-        Y = Y[np.newaxis, ...]
-        Z = wpe(Y, taps=10, delay=3, iterations=3, statistics_mode='full')
-        z = istft(Z[0].T, size=stft_options['size'], shift=stft_options['shift'])
-        z = z / np.max(np.abs(z)) * 0.9
-        dereverb_path = audio_path.replace('.wav', '_dereverb.wav')
-        sf.write(dereverb_path, z, sr)
-        return dereverb_path
+        # torch's CPU STFT runs on the multithreaded MKL/pocketfft backend,
+        # unlike nara_wpe's numpy one; only WPE itself stays in numpy
+        window = torch.hann_window(512)
+        Y = torch.stft(wav, n_fft=512, hop_length=128, window=window, return_complex=True).numpy()
+        # (F, T) -> (F, D=1, T): one single-channel WPE problem per frequency bin
+        Z = wpe(Y[:, np.newaxis, :], taps=10, delay=3, iterations=3, statistics_mode='full')
+        # Keep complex64 end to end; wpe() may promote to complex128
+        z = torch.istft(
+            torch.from_numpy(Z[:, 0, :].astype(np.complex64, copy=False)), n_fft=512, hop_length=128, window=window, length=len(wav)
+        ).numpy()
+        # Peak-normalize in place: min/max reductions avoid an np.abs() copy
+        z = z.astype(np.float32, copy=False)
+        peak = max(-z.min(), z.max())
+        if peak > 0:
+            np.multiply(z, 0.9 / peak, out=z)
+        return torch.from_numpy(z)
     except Exception as e:
         print(f"WPE dereverberation failed: {e}")
-        return audio_path
-
-
-def apply_vad(audio_path: str) -> str:
-    """Apply Silero VAD to remove silence"""
+        return None
+
+
+def find_active_regions(wav: torch.Tensor, sample_rate: int = 16000, frame_size: int = 512) -> list:
+    """Return (start, end) sample ranges of a waveform that may hold speech"""
+    audio = wav.numpy()
+    n_frames = len(audio) // frame_size
+    if n_frames < 2:
+        return [(0, len(audio))]
+    frames = audio[: n_frames * frame_size].reshape(n_frames, frame_size)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    noise_floor, loud = np.percentile(rms, [10, 90])
+    noise_floor = max(noise_floor, 1e-5)
+    margin = 10 ** (VAD_ENERGY_MARGIN_DB / 20)
+    if loud > 1e-5 and loud < noise_floor * margin ** 2:
+        # Too little dynamic range to tell silence apart; let Silero see it all
+        return [(0, len(audio))]
+    active = rms > noise_floor * margin
+
+    # Runs of active frames; gaps too short to be worth skipping are bridged
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    min_skip = int(VAD_MIN_SKIP_S * sample_rate / frame_size)
+    regions = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        if regions and start - regions[-1][1] < min_skip:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    # Keep one frame of context either side; the last region takes the tail
+    return [
+        (max(start - 1, 0) * frame_size, len(audio) if end >= n_frames else (end + 1) * frame_size)
+        for start, end in regions
+    ]
+
+
+def apply_vad(wav: torch.Tensor, regions: list = None) -> torch.Tensor:
+    """
+    Apply Silero VAD to remove silence from a 16kHz waveform.
+    Silero only runs inside regions (default: the energy gate's own pick).
+    Returns None if Silero fails.
+    """
     try:
-        wav = read_audio(audio_path, sampling_rate=16000)
-        speech_timestamps = get_speech_timestamps(wav, vad_model, sampling_rate=16000)
+        if regions is None:
+            regions = find_active_regions(wav)
+        speech_timestamps = []
+        for start, end in regions:
+            for segment in get_speech_timestamps(
+                wav[start:end],
+                vad_model,
+                threshold=0.6,
+                min_silence_duration_ms=200,
+                speech_pad_ms=100,
+                sampling_rate=16000,
+            ):
+                speech_timestamps.append({"start": segment["start"] + start, "end": segment["end"] + start})
         if not speech_timestamps:
-            return audio_path
-        speech_wav = collect_chunks(speech_timestamps, wav)
-        vad_path = audio_path.replace('.wav', '_vad.wav')
-        torchaudio.save(vad_path, speech_wav.unsqueeze(0), 16000)
-        return vad_path
+            return wav
+        return collect_chunks(speech_timestamps, wav)
     except Exception as e:
         print(f"VAD processing failed: {e}")
-        return audio_path
+        return None
 
 
-def apply_diarization(audio_path: str) -> list:
-    """Apply pyannote speaker diarization"""
+def apply_diarization(wav: torch.Tensor, sample_rate: int) -> list:
+    """Apply pyannote speaker diarization to an in-memory waveform, None if it fails"""
     if diarization_pipeline is None:
         return []
     try:
-        diarization = diarization_pipeline(audio_path)
+        # Only the energy-gated regions go through pyannote, so long pauses
+        # cost no segmentation/embedding work; the gate is cheap enough that
+        # diarization still starts before preprocessing
+        regions = find_active_regions(wav, sample_rate)
+        if not regions:
+            return []
+        speech = torch.cat([wav[start:end] for start, end in regions])
+
+        # Map times on the cropped timeline back onto the original one
+        crop_starts = np.cumsum([0] + [end - start for start, end in regions[:-1]]) / sample_rate
+        region_starts = np.array([start for start, _ in regions]) / sample_rate
+
+        def to_original(t: float) -> float:
+            i = max(np.searchsorted(crop_starts, t, side="right") - 1, 0)
+            return float(region_starts[i] + t - crop_starts[i])
+
+        # pyannote accepts a (channel, time) tensor, so the audio is not decoded again
+        stream = torch.cuda.stream(diarization_stream) if diarization_stream is not None else nullcontext()
+        # Runs on a worker thread, where the module-level grad switch doesn't apply
+        with stream, torch.inference_mode():
+            diarization = diarization_pipeline({"waveform": speech.unsqueeze(0), "sample_rate": sample_rate})
         segments = []
         for turn, _, speaker in diarization.itertracks(yield_label=True):
             segments.append({
                 "speaker": speaker,
-                "start": round(turn.start, 2),
-                "end": round(turn.end, 2)
+                "start": round(to_original(turn.start), 2),
+                "end": round(to_original(turn.end), 2)
             })
         return segments
     except Exception as e:
         print(f"Diarization failed: {e}")
-        return []
+        return None
+
+
+def preprocess(wav: torch.Tensor, sample_rate: int, request: TranscribeRequest) -> tuple:
+    """
+    Run the enabled preprocessing stages, returns (16kHz wav, denoise_applied,
+    dereverb_applied, degraded). degraded is set when a stage failed and the
+    audio went on without it.
+    """
+    # Denoise runs before the 16kHz downsample so 48kHz uploads are never
+    # resampled twice
+    denoise_applied = False
+    degraded = False
+    vad_regions = None
+    if request.enable_denoise and (
+        request.force_denoise or estimate_snr_db(wav, sample_rate) <= DENOISE_SNR_THRESHOLD_DB
+    ):
+        # With VAD on, stretches the energy gate calls silent never reach the
+        # model, so only the active regions are denoised
+        regions = find_active_regions(wav, sample_rate) if request.enable_vad else None
+        denoised = apply_deepfilter(wav, sample_rate, regions)
+        degraded |= denoised is None
+        denoise_applied = denoised is not None and denoised is not wav
+        if denoise_applied:
+            if regions is not None:
+                # Only these regions were denoised, so VAD must not look
+                # anywhere else; map them onto the 16kHz timeline
+                vad_regions = [
+                    (start * 16000 // sample_rate, -(-end * 16000 // sample_rate)) for start, end in regions
+                ]
+            wav, sample_rate = denoised, 16000
+
+    wav = resample_to(wav, sample_rate, 16000)
+
+    dereverb_applied = False
+    if request.enable_dereverberation and len(wav) >= WPE_MIN_DURATION_S * 16000:
+        dereverbed = apply_wpe(wav)
+        dereverb_applied = dereverbed is not None
+        degraded |= not dereverb_applied
+        if dereverb_applied:
+            wav = dereverbed
+
+    if request.enable_vad:
+        speech = apply_vad(wav, vad_regions)
+        degraded |= speech is None
+        if speech is not None:
+            wav = speech
+
+    return wav, denoise_applied, dereverb_applied, degraded
+
+
+async def transcribe_audio(wav: torch.Tensor) -> str:
+    """Queue a 16kHz waveform for the batching worker and await its transcription"""
+    future = asyncio.get_running_loop().create_future()
+    await transcribe_queue.put((wav.numpy(), future))
+    return await future
+
+
+def transcribe_batch(audios: list) -> list:
+    """Transcribe a batch of 16kHz waveforms in a single model call"""
+    with torch.inference_mode(), torch.autocast(
+        device_type="cuda", dtype=ASR_AMP_DTYPE, enabled=(device == "cuda")
+    ):
+        transcriptions = model.transcribe(audios, batch_size=len(audios))
+    if isinstance(transcriptions, tuple):
+        # RNNT models return (best_hypotheses, all_hypotheses)
+        transcriptions = transcriptions[0]
+    # One hypothesis per input or none at all: guessing would hand one
+    # request's transcript to another, and a short list would strand futures
+    if not isinstance(transcriptions, list) or len(transcriptions) != len(audios):
+        raise RuntimeError(
+            f"Expected {len(audios)} transcriptions from the model, got {type(transcriptions).__name__}"
+            + (f" of length {len(transcriptions)}" if isinstance(transcriptions, list) else "")
+        )
+    return transcriptions
+
+
+async def transcribe_worker():
+    """Drain the transcription queue, batching up to MAX_BATCH requests"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await transcribe_queue.get()]
+        while len(batch) < MAX_BATCH and not transcribe_queue.empty():
+            batch.append(transcribe_queue.get_nowait())
+
+        audios = [audio for audio, _ in batch]
+        try:
+            results = await loop.run_in_executor(transcribe_executor, transcribe_batch, audios)
+            for (_, future), transcription in zip(batch, results):
+                if not future.done():
+                    future.set_result(transcription)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+@app.on_event("startup")
+async def start_transcribe_worker():
+    """Create the transcription queue and launch its worker"""
+    global transcribe_queue
+    transcribe_queue = asyncio.Queue()
+    app.state.transcribe_worker = asyncio.create_task(transcribe_worker())
+
+
+@app.on_event("startup")
+async def warmup():
+    """Run a short silent clip through every model before serving traffic"""
+    # Faint noise rather than digital silence: the energy gate drops pure
+    # zeros, which would leave Silero cold
+    silence = torch.randn(16000 * 3) * 1e-3
+    apply_deepfilter(silence)
+    apply_wpe(silence)
+    apply_vad(silence)
+    await asyncio.get_running_loop().run_in_executor(
+        transcribe_executor, transcribe_batch, [silence.numpy()]
+    )
+    print("Warmup complete")
 
 
 @app.post("/transcribe", response_model=TranscribeResponse)
 async def transcribe(request: TranscribeRequest):
     """Transcribe audio using NVIDIA Parakeet-TDT"""
     try:
-        # Decode and save audio
+        # Identical audio with identical options returns the prior response
+        cache_key = result_cache_key(request)
+        cached = get_cached_result(cache_key)
+        if cached is not None:
+            return cached.model_copy(update={"cached": True})
+
+        # Decode base64 audio
         audio_bytes = base64.b64decode(request.audio_base64)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio:
-            temp_audio.write(audio_bytes)
-            temp_audio_path = temp_audio.name
 
-        files_to_cleanup = [temp_audio_path]
-        current_path = temp_audio_path
+        # Decode once from memory, then keep the waveform there through every stage.
+        # Blocking torch/numpy work runs off the event loop so other
+        # requests can keep feeding the batching queue.
+        wav, sample_rate = await asyncio.to_thread(load_audio, io.BytesIO(audio_bytes))
+
+        # Speaker diarization is independent of the transcript, so it
+        # runs on its own executor alongside preprocessing + transcription
+        diarization_task = None
+        if request.enable_diarization:
+            diarization_task = asyncio.get_running_loop().run_in_executor(
+                diarization_executor, apply_diarization, wav, sample_rate
+            )
 
         try:
-            # Apply preprocessing pipeline
-            if request.enable_denoise:
-                denoised_path = apply_deepfilter(current_path)
-                if denoised_path != current_path:
-                    files_to_cleanup.append(denoised_path)
-                    current_path = denoised_path
-
-            if request.enable_dereverberation:
-                dereverb_path = apply_wpe(current_path)
-                if dereverb_path != current_path:
-                    files_to_cleanup.append(dereverb_path)
-                    current_path = dereverb_path
-
-            if request.enable_vad:
-                vad_path = apply_vad(current_path)
-                if vad_path != current_path:
-                    files_to_cleanup.append(vad_path)
-                    current_path = vad_path
+            wav, denoise_applied, dereverb_applied, degraded = await asyncio.get_running_loop().run_in_executor(
+                preprocess_executor, preprocess, wav, sample_rate, request
+            )
 
             # Transcribe using Parakeet-TDT
-            transcriptions = model.transcribe([current_path])
-            if isinstance(transcriptions, list) and len(transcriptions) > 0:
-                transcription = transcriptions[0]
+            if diarization_task is not None:
+                transcription, diarization_result = await asyncio.gather(
+                    transcribe_audio(wav), diarization_task
+                )
+                if diarization_result is None:
+                    degraded = True
+                    diarization_result = []
             else:
-                transcription = str(transcriptions)
-
-            # Speaker diarization
-            diarization_result = []
-            if request.enable_diarization:
-                diarization_result = apply_diarization(temp_audio_path)
-
-            return TranscribeResponse(
-                transcription=transcription,
-                denoise_applied=request.enable_denoise,
-                dereverb_applied=request.enable_dereverberation,
-                vad_applied=request.enable_vad,
-                diarization=diarization_result,
-            )
-
-        finally:
-            for f in files_to_cleanup:
-                if os.path.exists(f):
-                    os.remove(f)
+                transcription = await transcribe_audio(wav)
+                diarization_result = []
+        except BaseException:
+            # Drop a diarization still queued for a request that has already
+            # failed; one that has started can't be interrupted and finishes
+            # with its result discarded
+            if diarization_task is not None:
+                diarization_task.cancel()
+            raise
+
+        response = TranscribeResponse(
+            transcription=transcription,
+            denoise_applied=denoise_applied,
+            dereverb_applied=dereverb_applied,
+            vad_applied=request.enable_vad,
+            diarization=diarization_result,
+        )
+        # A stage that fell back after a (possibly transient) failure must not
+        # pin its degraded output in the cache for every later repeat
+        if not degraded:
+            store_result(cache_key, response)
+        return response
 
     except Exception as e:
         import traceback
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}\n{traceback.format_exc()}")
 
 
+@app.post("/transcribe/batch", response_model=list[Union[TranscribeResponse, TranscribeBatchError]])
+async def transcribe_batch_endpoint(batch: TranscribeBatchRequest):
+    """
+    Transcribe several clips in one call; they share model batches.
+    Results come back in request order, and a clip that fails gets an
+    {"error": ...} entry instead of failing the whole batch.
+    """
+    # At most MAX_BATCH clips are in flight: enough to fill one model batch
+    # while the next ones preprocess (serially, on preprocess_executor),
+    # without decoding every upload of a large batch up front
+    semaphore = asyncio.Semaphore(MAX_BATCH)
+
+    async def transcribe_limited(request: TranscribeRequest) -> Union[TranscribeResponse, TranscribeBatchError]:
+        async with semaphore:
+            try:
+                return await transcribe(request)
+            except HTTPException as e:
+                return TranscribeBatchError(error=e.detail)
+
+    return await asyncio.gather(*(transcribe_limited(request) for request in batch.requests))
+
+
 @app.get("/ping")
 async def ping():
     """Health check endpoint for RunPod Load Balancer"""
@@ -148,15 +148,16 @@ async def main():
 
     try:
         while running:
-            # マイクからデータを読み取り
+            # マイクからデータを読み取り（ブロッキング読み取りは別スレッドで行い、
+            # イベントループで受信イベントを処理し続ける）
             try:
-                data = stream.read(CHUNK_SIZE, exception_on_overflow=False)
+                data = await asyncio.to_thread(stream.read, CHUNK_SIZE, exception_on_overflow=False)
             except Exception as e:
                 print(f"\nマイク読み取りエラー: {e}")
                 continue
 
-            # Base64エンコードして送信
-            audio_base64 = base64.b64encode(data).decode('utf-8')
+            # Base64エンコードして送信（Base64は ASCII のみなので ascii でデコード）
+            audio_base64 = base64.b64encode(data).decode('ascii')
             try:
                 await connection.send({
                     "audio_base_64": audio_base64
@@ -166,9 +167,6 @@ async def main():
                     print(f"\n送信エラー: {e}")
                 break
 
-            # 少し待つ（リアルタイム相当）
-            await asyncio.sleep(0.01)
-
     except Exception as e:
         print(f"\nエラー: {e}")
 
@@ -200,7 +198,9 @@ def save_results():
     """結果をファイルに保存"""
     OUTPUT_DIR.mkdir(exist_ok=True)
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # 時刻は一度だけ取得し、ファイル名と本文の日時を揃える
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
     base_name = f"{timestamp}_mic_realtime"
 
     # 全文を結合
@@ -226,7 +226,7 @@ def save_results():
         f.write("=" * 60 + "\n")
         f.write("ElevenLabs Realtime STT - マイク入力結果\n")
         f.write("=" * 60 + "\n\n")
-        f.write(f"日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"日時: {now.strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write(f"確定文数: {len(final_texts)}\n\n")
         f.write("-" * 60 + "\n")
         f.write("トランスクリプト\n")
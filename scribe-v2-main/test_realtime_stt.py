@@ -7,43 +7,32 @@ ElevenLabs Realtime Speech to Text テストスクリプト
 import os
 import sys
 import json
+import re
 import asyncio
-import tempfile
 import base64
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
-from elevenlabs.realtime.scribe import RealtimeAudioOptions, AudioFormat, CommitStrategy
-from elevenlabs.realtime.connection import RealtimeEvents
-import yt_dlp
-import subprocess
 
 load_dotenv()
 
 OUTPUT_DIR = Path(__file__).parent / "results"
 
+# ファイル名に使えない文字（英数字・空白・ハイフン・アンダースコア以外）
+UNSAFE_TITLE_CHARS = re.compile(r'[^\w \-]')
 
-def download_audio_from_youtube(url: str, output_dir: str) -> tuple[str, str]:
-    """YouTubeから音声をダウンロード（PCM形式）"""
-    print(f"Downloading audio from: {url}")
 
-    output_template = os.path.join(output_dir, "audio.%(ext)s")
-    video_title = "unknown"
+def get_audio_stream_from_youtube(url: str) -> tuple[str, dict, str]:
+    """YouTubeの音声ストリームURLを取得（ダウンロードはしない）"""
+    import yt_dlp  # 読み込みが重いため使用時にインポート
+
+    print(f"Resolving audio stream: {url}")
 
     ydl_opts = {
         'format': 'bestaudio[ext=m4a]/bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'wav',
-            'preferredquality': '192',
-        }],
-        'outtmpl': output_template,
         'noplaylist': True,
         'quiet': True,
         'no_warnings': True,
-        'retries': 5,
-        'fragment_retries': 5,
         'http_headers': {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         },
@@ -55,39 +44,28 @@ def download_audio_from_youtube(url: str, output_dir: str) -> tuple[str, str]:
     }
 
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-        video_title = info.get('title', 'unknown')
-
-    wav_path = os.path.join(output_dir, "audio.wav")
+        info = ydl.extract_info(url, download=False)
 
-    # WAVを16kHz mono PCMに変換
-    pcm_path = os.path.join(output_dir, "audio_16k.wav")
-    subprocess.run([
-        'ffmpeg', '-y', '-i', wav_path,
-        '-ar', '16000', '-ac', '1', '-f', 'wav',
-        pcm_path
-    ], capture_output=True)
-
-    print("Download complete!")
-    return pcm_path, video_title
+    return info['url'], info.get('http_headers', {}), info.get('title', 'unknown')
 
 
 def format_timestamp(seconds: float) -> str:
     """秒数をMM:SS.ms形式に変換"""
-    minutes = int(seconds // 60)
-    secs = seconds % 60
-    return f"{minutes:02d}:{secs:05.2f}"
-
+    minutes, secs = divmod(seconds, 60)
+    return f"{int(minutes):02d}:{secs:05.2f}"
 
-async def transcribe_realtime(file_path: str) -> dict:
-    """リアルタイムAPIで音声を文字起こし"""
-    api_key = os.getenv("ELEVENLABS_API_KEY")
 
-    if not api_key:
-        print("Error: ELEVENLABS_API_KEY not found")
-        sys.exit(1)
+async def transcribe_realtime(stream_info: asyncio.Future, api_key: str) -> dict:
+    """
+    リアルタイムAPIで音声を文字起こし（ffmpegでストリームを16kHz PCMにデコードしながら送信）
+    stream_info は (stream_url, http_headers, video_title) を返すFuture
+    """
+    # 読み込みが重いため使用時にインポート
+    from elevenlabs.client import ElevenLabs
+    from elevenlabs.realtime.scribe import RealtimeAudioOptions, AudioFormat, CommitStrategy
+    from elevenlabs.realtime.connection import RealtimeEvents
 
-    print(f"Transcribing (Realtime): {file_path}")
+    print("Transcribing (Realtime) from stream...")
 
     client = ElevenLabs(api_key=api_key)
 
@@ -95,6 +73,11 @@ async def transcribe_realtime(file_path: str) -> dict:
     all_transcripts = []
     all_words = []
 
+    # commit() 後の確定トランスクリプト受信を通知するイベント
+    loop = asyncio.get_running_loop()
+    final_committed = asyncio.Event()
+    commit_sent = False
+
     # コールバック関数
     def on_partial(data):
         text = data.get('text', '') if isinstance(data, dict) else getattr(data, 'text', '')
@@ -117,6 +100,9 @@ async def transcribe_realtime(file_path: str) -> dict:
             })
             display_text = text[:50] if len(text) > 50 else text
             print(f"  [FINAL] {display_text}...")
+        if commit_sent:
+            # コールバックが別スレッドから呼ばれても安全にセットする
+            loop.call_soon_threadsafe(final_committed.set)
 
     def on_error(data):
         print(f"  [ERROR] {data}")
@@ -131,15 +117,29 @@ async def transcribe_realtime(file_path: str) -> dict:
         'commit_strategy': CommitStrategy.MANUAL,
     }
 
-    # 接続
-    connection = await client.speech_to_text.realtime.connect(options)
+    # 接続（TCP+TLSハンドシェイクをストリームURLの取得と並行して行う）
+    connect_task = asyncio.create_task(client.speech_to_text.realtime.connect(options))
+    try:
+        stream_url, http_headers, _ = await stream_info
+    except BaseException:
+        # ストリームURLの取得に失敗したら、並行して張った接続も閉じる
+        connect_task.cancel()
+        try:
+            connection = await connect_task
+        except BaseException:
+            pass
+        else:
+            await connection.close()
+        raise
+    connection = await connect_task
     connection.on(RealtimeEvents.PARTIAL_TRANSCRIPT, on_partial)
     connection.on(RealtimeEvents.COMMITTED_TRANSCRIPT, on_committed)
     connection.on(RealtimeEvents.ERROR, on_error)
 
     print("Starting realtime transcription...")
 
-    # 音声ファイルを読み込んでチャンクで送信
+    # ダウンロードしながらffmpegで16kHz mono PCMにデコードし、パイプからチャンクで送信
+    # （一時ファイルを介さず、ダウンロード完了を待たずに送信を始められる）
     # 16kHz, 16bit mono = 32000 bytes/sec
     # リアルタイム相当の速度で送信
     sample_rate = 16000
@@ -147,41 +147,66 @@ async def transcribe_realtime(file_path: str) -> dict:
     chunk_duration_ms = 100  # 100msごとに送信
     chunk_size = int(sample_rate * bytes_per_sample * chunk_duration_ms / 1000)  # 3200 bytes
 
+    headers = ''.join(f"{key}: {value}\r\n" for key, value in http_headers.items())
+    ffmpeg = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-loglevel', 'error',
+        '-headers', headers, '-i', stream_url,
+        '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', 'pipe:1',
+        stdout=asyncio.subprocess.PIPE,
+    )
+
     try:
+        # 送信間隔（リアルタイム相当の速度で送信、少し速め: 2倍速）
+        send_interval = chunk_duration_ms / 1000 / 2
+        start_time = loop.time()
+
+        chunk_count = 0
+        while True:
+            try:
+                chunk = await ffmpeg.stdout.readexactly(chunk_size)
+            except asyncio.IncompleteReadError as e:
+                # ストリーム終端の端数チャンク
+                chunk = e.partial
+            if not chunk:
+                break
+            # Base64エンコードして送信（プロトコルがJSONのみ対応のためバイナリ送信は不可）
+            audio_base64 = base64.b64encode(chunk).decode('ascii')
+            await connection.send({
+                "audio_base_64": audio_base64
+            })
+            chunk_count += 1
 
-        with open(file_path, 'rb') as f:
-            # WAVヘッダーをスキップ（44バイト）
-            f.seek(44)
-
-            chunk_count = 0
-            while True:
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
-                # Base64エンコードして送信
-                audio_base64 = base64.b64encode(chunk).decode('utf-8')
-                await connection.send({
-                    "audio_base_64": audio_base64
-                })
-                chunk_count += 1
-
-                # 進捗表示
-                if chunk_count % 50 == 0:
-                    elapsed = chunk_count * chunk_duration_ms / 1000
-                    print(f"  Sent {chunk_count} chunks ({elapsed:.1f}s of audio)...")
-
-                # リアルタイム相当の速度で送信（少し速め: 2倍速）
-                await asyncio.sleep(chunk_duration_ms / 1000 / 2)
+            # 進捗表示
+            if chunk_count % 50 == 0:
+                elapsed = chunk_count * chunk_duration_ms / 1000
+                print(f"  Sent {chunk_count} chunks ({elapsed:.1f}s of audio)...")
+
+            # 開始時刻基準の絶対時刻まで待つ（送信時間分のずれが蓄積しない）
+            await asyncio.sleep(max(0.0, start_time + chunk_count * send_interval - loop.time()))
 
         print(f"  Total chunks sent: {chunk_count}")
 
+        # 期限切れ・403などのストリームURLではffmpegが何も出力せずに終わるので、
+        # 空の結果を成功として保存しないようここで止める
+        await ffmpeg.wait()
+        if ffmpeg.returncode != 0 or chunk_count == 0:
+            print(f"Error: ffmpeg failed to decode the audio stream (exit code {ffmpeg.returncode}, {chunk_count} chunks sent)")
+            sys.exit(1)
+
         # 最終トランスクリプトをコミット
+        commit_sent = True
         await connection.commit()
 
-        # 少し待って最終結果を受信
-        await asyncio.sleep(3)
+        # 確定結果を受信するまで待つ（無音などで返らない場合はタイムアウト）
+        try:
+            await asyncio.wait_for(final_committed.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            print("  Timed out waiting for the final transcript")
 
     finally:
+        if ffmpeg.returncode is None:
+            ffmpeg.kill()
+        await ffmpeg.wait()
         await connection.close()
 
     return {
@@ -221,8 +246,10 @@ def save_realtime_results(results: dict, analysis: dict, video_title: str, youtu
     """リアルタイム結果を保存"""
     OUTPUT_DIR.mkdir(exist_ok=True)
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_title = "".join(c for c in video_title[:30] if c.isalnum() or c in (' ', '-', '_')).strip()
+    # 時刻は一度だけ取得し、ファイル名と本文の日時を揃える
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    safe_title = UNSAFE_TITLE_CHARS.sub('', video_title[:30]).strip()
     base_name = f"{timestamp}_realtime_{safe_title}"
 
     # JSONファイルに保存
@@ -249,7 +276,7 @@ def save_realtime_results(results: dict, analysis: dict, video_title: str, youtu
 
         f.write(f"動画タイトル: {video_title}\n")
         f.write(f"YouTube URL: {youtube_url}\n")
-        f.write(f"処理日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"処理日時: {now.strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write(f"API種別: Realtime\n")
         f.write(f"トランスクリプト数: {analysis['transcript_count']}\n")
         f.write(f"確定トランスクリプト数: {analysis['final_count']}\n")
@@ -274,6 +301,12 @@ def save_realtime_results(results: dict, analysis: dict, video_title: str, youtu
 
 
 async def main():
+    # APIキーはストリーム取得や重いインポートより先に確認する
+    api_key = os.getenv("ELEVENLABS_API_KEY")
+    if not api_key:
+        print("Error: ELEVENLABS_API_KEY not found")
+        sys.exit(1)
+
     # デフォルトのテスト用YouTube URL（短い動画を使用）
     default_url = "https://youtu.be/GhjHDihkquE"
 
@@ -283,49 +316,43 @@ async def main():
     print("ElevenLabs Realtime Speech to Text Test")
     print("=" * 70)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # YouTubeから音声をダウンロード
-        audio_path, video_title = download_audio_from_youtube(youtube_url, tmpdir)
-
-        if not os.path.exists(audio_path):
-            print(f"Error: Audio file not found at {audio_path}")
-            sys.exit(1)
-
-        file_size = os.path.getsize(audio_path)
-        print(f"\n動画タイトル: {video_title}")
-        print(f"音声ファイルサイズ: {file_size / 1024:.2f} KB")
-
-        # リアルタイム文字起こし実行
-        print("\n" + "-" * 70)
-        print("リアルタイム文字起こし中...")
-        print("-" * 70 + "\n")
+    # YouTubeの音声ストリームの取得（yt-dlpは数秒かかる）を別スレッドで開始し、
+    # その間にリアルタイムAPIへ接続する
+    stream_info = asyncio.create_task(asyncio.to_thread(get_audio_stream_from_youtube, youtube_url))
 
-        results = await transcribe_realtime(audio_path)
+    # リアルタイム文字起こし実行
+    print("\n" + "-" * 70)
+    print("リアルタイム文字起こし中...")
+    print("-" * 70 + "\n")
 
-        # 結果を分析
-        print("\n結果を分析中...")
-        analysis = analyze_realtime_results(results)
+    results = await transcribe_realtime(stream_info, api_key)
+    _, _, video_title = stream_info.result()
+    print(f"\n動画タイトル: {video_title}")
 
-        # 結果を表示
-        print("\n" + "=" * 70)
-        print("REALTIME TRANSCRIPTION RESULT")
-        print("=" * 70)
-        print(f"\nトランスクリプト数: {analysis['transcript_count']}")
-        print(f"確定トランスクリプト数: {analysis['final_count']}")
-        print(f"話者分離: {'あり' if analysis['has_speaker_info'] else 'なし'}")
+    # 結果を分析
+    print("\n結果を分析中...")
+    analysis = analyze_realtime_results(results)
 
-        if analysis['has_speaker_info']:
-            print("\n話者統計:")
-            for speaker_id, stats in analysis['speakers'].items():
-                print(f"  【{speaker_id}】: {stats['count']}回")
-
-        print(f"\n全文（先頭500文字）:\n{analysis['full_text'][:500]}...")
-
-        # 結果を保存
-        saved_path = save_realtime_results(results, analysis, video_title, youtube_url)
-        print(f"\n結果を保存しました:")
-        print(f"  テキスト: {saved_path}")
-        print(f"  JSON: {saved_path.with_suffix('.json')}")
+    # 結果を表示
+    print("\n" + "=" * 70)
+    print("REALTIME TRANSCRIPTION RESULT")
+    print("=" * 70)
+    print(f"\nトランスクリプト数: {analysis['transcript_count']}")
+    print(f"確定トランスクリプト数: {analysis['final_count']}")
+    print(f"話者分離: {'あり' if analysis['has_speaker_info'] else 'なし'}")
+
+    if analysis['has_speaker_info']:
+        print("\n話者統計:")
+        for speaker_id, stats in analysis['speakers'].items():
+            print(f"  【{speaker_id}】: {stats['count']}回")
+
+    print(f"\n全文（先頭500文字）:\n{analysis['full_text'][:500]}...")
+
+    # 結果を保存
+    saved_path = save_realtime_results(results, analysis, video_title, youtube_url)
+    print(f"\n結果を保存しました:")
+    print(f"  テキスト: {saved_path}")
+    print(f"  JSON: {saved_path.with_suffix('.json')}")
 
 
 if __name__ == "__main__":
@@ -8,21 +8,26 @@ YouTubeから音声をダウンロードしてSpeech to Text APIをテスト
 import os
 import sys
 import json
+import re
 import tempfile
+from itertools import groupby
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
-import yt_dlp
 
 load_dotenv()
 
 # 出力ディレクトリ
 OUTPUT_DIR = Path(__file__).parent / "results"
 
+# ファイル名に使えない文字（英数字・空白・ハイフン・アンダースコア以外）
+UNSAFE_TITLE_CHARS = re.compile(r'[^\w \-]')
+
 
 def download_audio_from_youtube(url: str, output_dir: str) -> tuple[str, str]:
     """YouTubeから音声をダウンロード"""
+    import yt_dlp  # 読み込みが重いため使用時にインポート
+
     print(f"Downloading audio from: {url}")
 
     output_template = os.path.join(output_dir, "audio.%(ext)s")
@@ -61,20 +66,13 @@ def download_audio_from_youtube(url: str, output_dir: str) -> tuple[str, str]:
 
 def format_timestamp(seconds: float) -> str:
     """秒数をMM:SS.ms形式に変換"""
-    minutes = int(seconds // 60)
-    secs = seconds % 60
-    return f"{minutes:02d}:{secs:05.2f}"
+    minutes, secs = divmod(seconds, 60)
+    return f"{int(minutes):02d}:{secs:05.2f}"
 
 
-def transcribe_audio(file_path: str) -> dict:
+def transcribe_audio(file_path: str, api_key: str) -> dict:
     """ElevenLabs APIで音声を文字起こし"""
-    api_key = os.getenv("ELEVENLABS_API_KEY")
-
-    if not api_key:
-        print("Error: ELEVENLABS_API_KEY not found in environment variables")
-        print("Please create a .env file with your API key:")
-        print("  ELEVENLABS_API_KEY=your_api_key_here")
-        sys.exit(1)
+    from elevenlabs.client import ElevenLabs  # 読み込みが重いため使用時にインポート
 
     print(f"Transcribing: {file_path}")
 
@@ -99,32 +97,10 @@ def analyze_speakers(result) -> dict:
 
     speakers = {}
     segments = []
-    current_speaker = None
-    current_segment_words = []
-    segment_start = 0
-
-    for word in result.words:
-        speaker_id = getattr(word, 'speaker_id', None)
-
-        if speaker_id != current_speaker:
-            # 話者が変わった場合、前のセグメントを保存
-            if current_speaker is not None and current_segment_words:
-                segment_text = ''.join([w.text for w in current_segment_words])
-                segment_end = current_segment_words[-1].end
-                segments.append({
-                    'speaker': current_speaker,
-                    'start': segment_start,
-                    'end': segment_end,
-                    'text': segment_text,
-                    'word_count': len(current_segment_words)
-                })
-
-            # 新しいセグメント開始
-            current_speaker = speaker_id
-            current_segment_words = [word]
-            segment_start = word.start
-        else:
-            current_segment_words.append(word)
+
+    # 同じ話者が続く単語をまとめて1セグメントにする（groupbyで境界をCレベルで検出）
+    for speaker_id, group in groupby(result.words, key=lambda w: getattr(w, 'speaker_id', None)):
+        segment_words = list(group)
 
         # 話者ごとの統計を更新
         if speaker_id not in speakers:
@@ -133,26 +109,26 @@ def analyze_speakers(result) -> dict:
                 'total_duration': 0,
                 'segment_count': 0
             }
-        speakers[speaker_id]['total_words'] += 1
+        stats = speakers[speaker_id]
+        stats['total_words'] += len(segment_words)
 
-    # 最後のセグメントを保存
-    if current_speaker is not None and current_segment_words:
-        segment_text = ''.join([w.text for w in current_segment_words])
-        segment_end = current_segment_words[-1].end
+        # 話者不明の単語はセグメントにしない
+        if speaker_id is None:
+            continue
+
+        segment_start = segment_words[0].start
+        segment_end = segment_words[-1].end
         segments.append({
-            'speaker': current_speaker,
+            'speaker': speaker_id,
             'start': segment_start,
             'end': segment_end,
-            'text': segment_text,
-            'word_count': len(current_segment_words)
+            'text': ''.join([w.text for w in segment_words]),
+            'word_count': len(segment_words)
         })
 
-    # セグメントから話者ごとの発話時間を計算
-    for seg in segments:
-        speaker = seg['speaker']
-        if speaker in speakers:
-            speakers[speaker]['total_duration'] += (seg['end'] - seg['start'])
-            speakers[speaker]['segment_count'] += 1
+        # セグメントから話者ごとの発話時間を計算
+        stats['total_duration'] += (segment_end - segment_start)
+        stats['segment_count'] += 1
 
     return {
         'speakers': speakers,
@@ -164,10 +140,14 @@ def save_results(result, analysis: dict, video_title: str, youtube_url: str) ->
     """結果をファイルに保存"""
     OUTPUT_DIR.mkdir(exist_ok=True)
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_title = "".join(c for c in video_title[:30] if c.isalnum() or c in (' ', '-', '_')).strip()
+    # 時刻は一度だけ取得し、ファイル名と本文の日時を揃える
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    safe_title = UNSAFE_TITLE_CHARS.sub('', video_title[:30]).strip()
     base_name = f"{timestamp}_{safe_title}"
 
+    words = getattr(result, 'words', None) or []
+
     # JSONファイルに完全な結果を保存
     json_path = OUTPUT_DIR / f"{base_name}.json"
     json_data = {
@@ -192,7 +172,7 @@ def save_results(result, analysis: dict, video_title: str, youtube_url: str) ->
                 'speaker_id': getattr(w, 'speaker_id', None),
                 'type': getattr(w, 'type', None)
             }
-            for w in (result.words if hasattr(result, 'words') and result.words else [])
+            for w in words
         ]
     }
     with open(json_path, 'w', encoding='utf-8') as f:
@@ -207,7 +187,7 @@ def save_results(result, analysis: dict, video_title: str, youtube_url: str) ->
 
         f.write(f"動画タイトル: {video_title}\n")
         f.write(f"YouTube URL: {youtube_url}\n")
-        f.write(f"処理日時: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"処理日時: {now.strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write(f"検出言語: {getattr(result, 'language_code', 'N/A')} ")
         f.write(f"(確信度: {getattr(result, 'language_probability', 'N/A'):.1%})\n")
         f.write("\n")
@@ -286,6 +266,14 @@ def print_results(result, analysis: dict):
 
 
 def main():
+    # APIキーはダウンロードや重いインポートより先に確認する
+    api_key = os.getenv("ELEVENLABS_API_KEY")
+    if not api_key:
+        print("Error: ELEVENLABS_API_KEY not found in environment variables")
+        print("Please create a .env file with your API key:")
+        print("  ELEVENLABS_API_KEY=your_api_key_here")
+        sys.exit(1)
+
     # デフォルトのテスト用YouTube URL
     default_url = "https://www.youtube.com/watch?v=jNQXAC9IVRw"
 
@@ -326,7 +314,7 @@ def main():
         print("文字起こし中...")
         print("-" * 70)
 
-        result = transcribe_audio(actual_path)
+        result = transcribe_audio(actual_path, api_key)
 
         # 話者分析
         print("話者分析中...")